@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
 import argparse
+import atexit
 import csv
+import io
+import json
 import os
+import re
 import subprocess
 import sys
 import shutil
+import tarfile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import datetime
-from urllib.parse import urlparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
+from functools import lru_cache
+from itertools import zip_longest
 import signal
 
+try:
+    # Opcional: lee refs y árboles del repo bare en proceso, sin lanzar git
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 signal.signal(signal.SIGINT, signal.default_int_handler)
 
 # === Rutas generales ===
@@ -31,92 +48,454 @@ TXT_NOT_FOUND = os.path.join(ANALYSIS_TXT_DIR, "analysis-not-found.txt")
 CSV_MIGRATION = os.path.join(ANALYSIS_CSV_DIR, "analysis-migration.csv")
 CSV_NOT_FOUND = os.path.join(ANALYSIS_CSV_DIR, "analysis-not-found.csv")
 CSV_BY_REPORT = os.path.join(ANALYSIS_CSV_DIR, "analysis-by-report.csv")
+REPO_CACHE_FILE = os.path.join(BASE_DIR, ".repo_exists_cache.json")
+REPO_CACHE_TTL = 3600  # segundos
+REPORT_BUFFER = 1 << 20  # 1 MiB: cada informe se vuelca con muy pocas escrituras
 os.makedirs(ANALYSIS_TXT_DIR, exist_ok=True)
 os.makedirs(ANALYSIS_CSV_DIR, exist_ok=True)
 os.makedirs(CLONES_DIR, exist_ok=True)
 os.makedirs(MIGRATIONS_DIR, exist_ok=True)
-LOG_FILE = None
+# Fichero de log abierto una sola vez en main(); se vuelca al salir (atexit)
+LOG_FH = None
+# Los clonados corren en hilos: el lock evita que se mezclen las líneas de log
+LOG_LOCK = threading.Lock()
 
 def log(msg):
-    print(msg)
-    if LOG_FILE:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(LOG_FILE, "a") as f:
-            f.write(f"[{timestamp}] {msg}\n")
-
-def run_git_cmd(cmd, cwd=None):
+    with LOG_LOCK:
+        print(msg)
+        if LOG_FH:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            LOG_FH.write(f"[{timestamp}] {msg}\n")
+
+# Protocolo v2: el servidor solo anuncia las refs pedidas (los repos de OCA tienen miles).
+# Sin mantenimiento automático: cada clone/fetch/archive lanzaría otro proceso git
+GIT_CONFIG = {
+    "protocol.version": "2",
+    "fetch.negotiationAlgorithm": "skipping",
+    "maintenance.auto": "false",
+    "gc.auto": "0",
+}
+
+# Se activa con Ctrl+C: los hilos que siguen trabajando no lanzan más comandos git
+INTERRUPTED = threading.Event()
+
+def run_git_cmd(cmd, cwd=None, config_overrides=None, capture=False, text=True):
+    if INTERRUPTED.is_set():
+        raise KeyboardInterrupt
     try:
         env = os.environ.copy()
         env["GIT_TERMINAL_PROMPT"] = "0"
-        subprocess.run(["git"] + cmd, cwd=cwd, check=False, env=env)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+        config = dict(GIT_CONFIG, **(config_overrides or {}))
+        config_args = []
+        for key, value in config.items():
+            config_args += ["-c", f"{key}={value}"]
+        result = subprocess.run(
+            ["git"] + config_args + cmd,
+            cwd=cwd,
+            check=False,
+            env=env,
+            # Sin progreso por objeto en pantalla: solo se muestra stderr si falla
+            stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=text,
+        )
+        if not text:
+            # Salida binaria (git archive): stderr se decodifica para el log
+            result.stderr = result.stderr.decode("utf-8", "replace")
+        if result.returncode != 0 and result.stderr.strip():
+            log(result.stderr.strip())
+        return result
     except KeyboardInterrupt:
         log("🛑 Ctrl+C durante operación Git.")
         raise
 
-def repo_exists(repo_url):
+# Sesión compartida por todos los hilos: reutiliza conexiones keep-alive con GitHub
+# y reintenta los fallos transitorios del servidor
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "odoo-mig-analyzer"
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+))
+
+# Mensajes de git cuando el repositorio no existe (GitHub pide credenciales en ese caso).
+# Solo "repository ... not found": "Remote branch X not found" es una rama que falta
+REPO_NOT_FOUND_RE = re.compile(
+    r"repository (?:'[^']*' )?not found"
+    r"|404"
+    r"|does not appear to be a git repository"
+    r"|could not read Username",
+    re.IGNORECASE,
+)
+
+def is_repo_not_found(result):
+    return result.returncode != 0 and REPO_NOT_FOUND_RE.search(result.stderr) is not None
+
+# === Caché en disco de repositorios existentes (lo que dijeron git o la API)
+def load_repo_cache():
+    try:
+        with open(REPO_CACHE_FILE, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Un JSON válido con otra forma (p. ej. de versiones anteriores) se descarta
+    return cache if isinstance(cache, dict) else {}
+
+def save_repo_cache(cache):
+    # Escritura atómica: un Ctrl+C a medias no deja un JSON corrupto
+    tmp = f"{REPO_CACHE_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp, REPO_CACHE_FILE)
+
+def cached_repo_exists(cache, repo_url):
+    # True/False si hay una entrada reciente, None si hay que preguntar a la red
+    # (también si la entrada está mal formada, p. ej. {status, ts} de versiones anteriores)
+    entry = cache.get(repo_url)
+    try:
+        exists = entry["exists"]
+        age = datetime.datetime.now() - datetime.datetime.fromisoformat(entry["ts"])
+    except (TypeError, KeyError, ValueError):
+        return None
+    if not isinstance(exists, bool):
+        return None
+    return exists if age.total_seconds() < REPO_CACHE_TTL else None
+
+# esquema://host/<owner>/<repo>[.git][/resto]; se compila una vez y se usa por fila
+_REPO_URL_RE = re.compile(
+    r"^[A-Za-z][\w+.-]*://(?P<host>[^/]*)/(?P<owner>[^/]+)/(?P<repo>[^/?#]+?)(?:\.git)?(?:[/?#].*)?$"
+)
+
+# La misma URL se repite en cada módulo del repositorio: se parsea una sola vez
+@lru_cache(maxsize=None)
+def extract_repo_name(url):
+    match = _REPO_URL_RE.match(url)
+    return match.group("repo") if match else None
+
+# === API de GitHub: basta con el árbol de cada rama para saber qué carpetas existen
+GITHUB_API = "https://api.github.com"
+GITHUB_API_HEADERS = {"Accept": "application/vnd.github+json"}
+if os.environ.get("GITHUB_TOKEN"):
+    GITHUB_API_HEADERS["Authorization"] = f"Bearer {os.environ['GITHUB_TOKEN']}"
+# Se activa al agotar el límite de peticiones: el resto del análisis usa git clone
+GITHUB_API_DISABLED = threading.Event()
+
+def fetch_tree(repo_url, branch):
+    # Conjunto de carpetas de la rama, o None si hay que recurrir a git clone
+    match = _REPO_URL_RE.match(repo_url)
+    if not match or match.group("host") not in ("github.com", "www.github.com"):
+        return None
+    if GITHUB_API_DISABLED.is_set() or INTERRUPTED.is_set():
+        return None
+    owner, repo = match.group("owner"), match.group("repo")
     try:
-        response = requests.head(repo_url.replace(".git", ""), timeout=5)
-        return response.status_code == 200
+        response = SESSION.get(
+            f"{GITHUB_API}/repos/{owner}/{repo}/git/trees/{branch}",
+            params={"recursive": "1"},
+            headers=GITHUB_API_HEADERS,
+            timeout=30,
+        )
     except KeyboardInterrupt:
-        log("🛑 Interrupción durante verificación de repositorio.")
         raise
     except Exception as e:
-        log(f"⚠️ Error al verificar repo: {e}")
-        return False
-
-def extract_repo_name(url):
+        log(f"⚠️ Error en la API de GitHub ({repo} @ {branch}): {e}")
+        return None
+    if response.status_code in (403, 429) and response.headers.get("X-RateLimit-Remaining") == "0":
+        if not GITHUB_API_DISABLED.is_set():
+            GITHUB_API_DISABLED.set()
+            log("⚠️ Límite de la API de GitHub alcanzado, se usará git clone (define GITHUB_TOKEN)")
+        return None
+    if response.status_code != 200:
+        return None
     try:
-        return urlparse(url).path.strip("/").split("/")[1]
-    except:
+        data = response.json()
+        if data.get("truncated"):
+            # Árbol demasiado grande para una sola respuesta: se clona
+            return None
+        return {entry["path"] for entry in data["tree"] if entry.get("type") == "tree"}
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        # Respuesta que no es el JSON esperado (proxy, página de error...): se clona
+        log(f"⚠️ Respuesta inesperada de la API de GitHub ({repo} @ {branch}): {e!r}")
         return None
 
-def ensure_repo_cloned(repo_url, repo_dir, branch):
-    if os.path.exists(repo_dir):
-        log(f"🔁 Actualizando rama {branch} en {repo_dir}")
-        run_git_cmd(["fetch", "origin", branch], cwd=repo_dir)
-        run_git_cmd(["checkout", branch], cwd=repo_dir)
-        run_git_cmd(["reset", "--hard", f"origin/{branch}"], cwd=repo_dir)
+# Directorios comunes donde Odoo coloca módulos (relativos a la raíz del repositorio)
+MODULE_PARENTS = frozenset(("", "addons", "odoo/addons"))
+
+def tree_modules(tree_dirs):
+    modulos = set()
+    # Un solo rpartition por carpeta en lugar de probar cada prefijo
+    for path in tree_dirs:
+        parent, _, name = path.rpartition("/")
+        if parent in MODULE_PARENTS and not name.startswith('.'):
+            modulos.add(name)
+    return modulos
+
+def ensure_bare_repo(repo_url, bare_dir, branch=None):
+    # Un único repo bare por repositorio: las ramas comparten objetos y conexión.
+    # branch: rama confirmada por ls-remote que se clona en lugar de la rama por defecto
+    if os.path.exists(bare_dir):
+        return None
+    log(f"⬇️ Clonando {repo_url} (bare)")
+    cmd = ["clone", "--quiet", "--bare", "--depth", "1", "--filter=blob:none", "--no-tags"]
+    if branch:
+        cmd += ["--branch", branch]
+    return run_git_cmd(cmd + [repo_url, bare_dir])
+
+def remote_heads(repo_url, branches):
+    # Un único ls-remote (sin descargar objetos) con el SHA de cada rama en el servidor
+    result = run_git_cmd(["ls-remote", "--heads", repo_url] + list(branches), capture=True)
+    heads = {}
+    if result.returncode == 0:
+        for line in result.stdout.splitlines():
+            sha, _, ref = line.partition("\t")
+            branch = ref.removeprefix("refs/heads/")
+            if branch in branches:
+                heads[branch] = sha
+    return result, heads
+
+def local_heads(bare_dir):
+    # SHA de refs/remotes/origin/<rama> guardado en el repo bare por el último fetch
+    prefix = "refs/remotes/origin/"
+    if pygit2:
+        try:
+            repo = pygit2.Repository(bare_dir)
+            return {
+                name[len(prefix):]: str(repo.references[name].target)
+                for name in repo.references
+                if name.startswith(prefix)
+            }
+        except pygit2.GitError:
+            pass
+    result = run_git_cmd(
+        ["for-each-ref", "--format=%(objectname) %(refname:lstrip=3)", prefix],
+        cwd=bare_dir,
+        capture=True,
+    )
+    return dict(line.split(" ", 1)[::-1] for line in result.stdout.splitlines())
+
+def _pygit2_tree_dirs(tree, prefix=""):
+    # Solo se recorren las entradas de tipo árbol: los blobs ni se cargan
+    dirs = set()
+    for entry in tree:
+        if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+            path = f"{prefix}{entry.name}"
+            dirs.add(path)
+            dirs |= _pygit2_tree_dirs(entry, f"{path}/")
+    return dirs
+
+def git_tree(bare_dir, branch):
+    # Carpetas de la rama leídas del repo bare (mismo formato que fetch_tree),
+    # sin worktree ni descarga de blobs
+    if pygit2:
+        try:
+            repo = pygit2.Repository(bare_dir)
+            commit = repo.revparse_single(f"refs/remotes/origin/{branch}")
+            return _pygit2_tree_dirs(commit.peel(pygit2.Tree))
+        except KeyError:
+            return None
+        except pygit2.GitError:
+            pass
+    result = run_git_cmd(
+        ["ls-tree", "-r", "-d", "--name-only", "-z", f"refs/remotes/origin/{branch}"],
+        cwd=bare_dir,
+        capture=True,
+    )
+    if result.returncode != 0:
+        return None
+    return set(filter(None, result.stdout.split("\0")))
+
+# Mensaje de git fetch cuando la rama no existe en el remoto (el repositorio sí)
+REMOTE_BRANCH_MISSING = "couldn't find remote ref"
+
+def fetch_branches(bare_dir, branches):
+    # Todas las ramas en un único fetch: una sola negociación con el servidor.
+    # Devuelve (ramas descargadas, {rama: resultado del fetch que falló})
+    refspecs = [f"+refs/heads/{b}:refs/remotes/origin/{b}" for b in branches]
+    result = run_git_cmd(["fetch", "--quiet", "--depth", "1", "--no-tags", "origin"] + refspecs, cwd=bare_dir)
+    if result.returncode == 0:
+        return list(branches), {}
+    if len(branches) == 1 or REMOTE_BRANCH_MISSING not in result.stderr:
+        # Fallo de red, credenciales...: afecta a todas las ramas
+        return [], {b: result for b in branches}
+    # Alguna rama no existe en el remoto y git aborta el fetch entero: rama a rama
+    fetched, fallidas = [], {}
+    for b, refspec in zip(branches, refspecs):
+        result = run_git_cmd(["fetch", "--quiet", "--depth", "1", "--no-tags", "origin", refspec], cwd=bare_dir)
+        if result.returncode == 0:
+            fetched.append(b)
+        else:
+            fallidas[b] = result
+    return fetched, fallidas
+
+def probe_repo(repo_url):
+    # --dry-run: sin clonar, solo se comprueba que el repositorio existe
+    return {}, not is_repo_not_found(run_git_cmd(["ls-remote", "--heads", repo_url]))
+
+def remove_checkouts(repo, bare_dir, branches):
+    # Clones completos y worktrees repos/<repo>/<rama> de versiones anteriores del
+    # script: ahora todo se lee del repo bare. Solo se tocan las carpetas de las ramas
+    checkouts = [os.path.join(CLONES_DIR, repo, branch) for branch in branches]
+    checkouts = [path for path in checkouts if os.path.isdir(path) and not os.path.islink(path)]
+    if checkouts:
+        for path in checkouts:
+            log(f"🧹 Eliminando checkout antiguo {path} (ahora se usa {bare_dir})")
+            shutil.rmtree(path, ignore_errors=True)
+        run_git_cmd(["worktree", "prune"], cwd=bare_dir)
+
+def sync_repo(repo_url, repo, branches, api_pool=None):
+    # Primero la API de GitHub; solo se clonan las ramas que no se pueden resolver así.
+    # Tanto el análisis como la copia de las carpetas migrations se hacen sobre el repo bare
+    arboles = {}
+    pendientes = []
+    # api_pool: peticiones a la API compartidas por todos los repositorios (None: sin API);
+    # las ramas de un mismo repositorio se piden en paralelo
+    if api_pool:
+        trees = list(api_pool.map(lambda branch: fetch_tree(repo_url, branch), branches))
     else:
-        log(f"⬇️ Clonando {repo_url} @ {branch}")
-        run_git_cmd(["clone", "--depth", "1", "--branch", branch, "--filter=blob:none", repo_url, repo_dir])
-
-def save_migrations(repo, branch, module, src_root):
-    src = os.path.join(src_root, module, "migrations")
-    if not os.path.isdir(src):
-        return
+        trees = [None] * len(branches)
+    for branch, tree in zip(branches, trees):
+        if tree is None:
+            pendientes.append(branch)
+        else:
+            arboles[branch] = tree
+
+    if pendientes:
+        # El ls-remote dice, antes de clonar nada, si el repositorio existe y qué
+        # ramas tiene; el primer comando git que falla por "no encontrado" lo descarta
+        bare_dir = os.path.join(CLONES_DIR, repo, ".bare")
+        listado, remotas = remote_heads(repo_url, pendientes)
+        if not arboles and is_repo_not_found(listado):
+            return arboles, False
+        existentes = [b for b in pendientes if b in remotas] if listado.returncode == 0 else pendientes
+        if not existentes:
+            # Ninguna rama pedida existe: no hace falta clonar
+            return arboles, True
+        # Sin ls-remote no se sabe si la rama existe: se clona la rama por defecto
+        result = ensure_bare_repo(repo_url, bare_dir, existentes[0] if listado.returncode == 0 else None)
+        if result is not None and result.returncode != 0:
+            # Clon fallido: no se deja la carpeta vacía del repositorio
+            try:
+                os.rmdir(os.path.join(CLONES_DIR, repo))
+            except OSError:
+                pass
+            if is_repo_not_found(result):
+                return arboles, False
+            # Red, credenciales...: el repositorio no se ha podido analizar
+            raise RuntimeError(f"git clone falló (código {result.returncode})")
+        remove_checkouts(repo, bare_dir, branches)
+        if listado.returncode == 0:
+            # Solo se descargan las ramas que han cambiado en el servidor
+            locales = local_heads(bare_dir)
+            a_traer = [b for b in existentes if locales.get(b) != remotas[b]]
+        else:
+            a_traer = existentes
+        fetched, fallidas = fetch_branches(bare_dir, a_traer) if a_traer else ([], {})
+        for branch in existentes:
+            if branch in fallidas:
+                result = fallidas[branch]
+                if REMOTE_BRANCH_MISSING in result.stderr:
+                    continue  # la rama no existe en el servidor
+                # No se pudo actualizar: se analiza la copia que ya hay en el repo bare
+                tree = git_tree(bare_dir, branch)
+                if tree is None:
+                    raise RuntimeError(f"git fetch de {branch} falló (código {result.returncode})")
+                log(f"⚠️ No se pudo actualizar la rama {branch}: se analiza la copia local")
+                arboles[branch] = tree
+                continue
+            if branch not in a_traer:
+                log(f"✔️ Rama {branch} al día en {bare_dir}")
+            tree = git_tree(bare_dir, branch)
+            if tree is not None:
+                arboles[branch] = tree
+        if fallidas and any(REMOTE_BRANCH_MISSING not in r.stderr for r in fallidas.values()):
+            # Resultado con ramas sin actualizar: no se da por comprobado (no se cachea)
+            return arboles, None
+    return arboles, True
+
+def save_migrations(repo, branch, modules, bare_dir):
+    # Un solo git archive por rama con las carpetas migrations de todos sus módulos:
+    # los blobs que falten se descargan en un único lote y no hace falta worktree
     dest_repo = os.path.join(MIGRATIONS_DIR, repo)
-    os.makedirs(dest_repo, exist_ok=True)
-    dest = os.path.join(dest_repo, f"{branch}_{module}")
-    if os.path.exists(dest):
-        shutil.rmtree(dest)
-    shutil.copytree(src, dest)
-
-def log_repo_modules(repo, branch, repo_dir, modules):
-    # Directorios comunes donde Odoo coloca módulos
-    search_dirs = [repo_dir, os.path.join(repo_dir, "addons"), os.path.join(repo_dir, "odoo", "addons")]
-
-    modulos_en_repo = set()
-    for d in search_dirs:
-        if os.path.isdir(d):
-            for name in os.listdir(d):
-                full_path = os.path.join(d, name)
-                if os.path.isdir(full_path) and not name.startswith('.'):
-                    modulos_en_repo.add(name)
-
-    modulos_csv = set(mod for mod, _, _ in modules)
-
-    instalados = [m for m in modulos_csv if m in modulos_en_repo]
-    no_encontrados = [m for m in modulos_csv if m not in modulos_en_repo]
+    dests = {module: os.path.join(dest_repo, f"{branch}_{module}") for module in modules}
 
+    # Si la rama no ha cambiado desde la última copia no se reescribe nada.
+    # La marca va junto a las copias (migrations/<repo>/.saved-<rama>), no en el repo bare
+    marker = os.path.join(dest_repo, f".saved-{branch}")
+    estado = "\n".join([local_heads(bare_dir).get(branch, "")] + sorted(modules))
+    try:
+        with open(marker, encoding="utf-8") as f:
+            if f.read() == estado and all(os.path.isdir(d) for d in dests.values()):
+                return
+    except OSError:
+        pass
+
+    result = run_git_cmd(
+        ["archive", "--format=tar", f"origin/{branch}"] + [f"{m}/migrations" for m in modules],
+        cwd=bare_dir,
+        capture=True,
+        text=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"git archive falló en {repo} @ {branch}")
+
+    for dest in dests.values():
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+    # <módulo>/migrations/<resto> se extrae en <rama>_<módulo>/<resto>, conservando
+    # enlaces simbólicos y permisos de ejecución
+    with tarfile.open(fileobj=io.BytesIO(result.stdout), mode="r:") as tar:
+        members = []
+        for member in tar:
+            parts = member.name.rstrip("/").split("/", 2)
+            if len(parts) < 2 or parts[1] != "migrations" or parts[0] not in dests:
+                continue
+            member.name = "/".join([f"{branch}_{parts[0]}"] + parts[2:])
+            members.append(member)
+
+        def filtro(member, path):
+            # Filtro "data": nada fuera del destino ni bits especiales; lo que
+            # rechaza (p. ej. un enlace que sale de la carpeta) se omite
+            try:
+                return tarfile.data_filter(member, path)
+            except tarfile.FilterError as e:
+                log(f"⚠️ {repo} @ {branch}: se omite {member.name} ({e})")
+                return None
+
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dest_repo, members=members, filter=filtro)
+        else:
+            # Python sin filtros de extracción: el tar lo genera git archive
+            tar.extractall(dest_repo, members=members)
+    os.makedirs(dest_repo, exist_ok=True)
+    with open(marker, "w", encoding="utf-8") as f:
+        f.write(estado)
+
+def save_repo_migrations(repo, modules_by_branch, bare_dir):
+    # Las ramas de un mismo repositorio se archivan una tras otra: cada git archive
+    # puede descargar blobs al mismo repo bare y no deben competir por sus ficheros
+    for branch, modules in modules_by_branch.items():
+        save_migrations(repo, branch, modules, bare_dir)
+
+def find_repo_modules(modulos_csv, tree=None):
+    # modulos_csv: frozenset con los módulos del CSV para este repositorio.
+    # tree: carpetas de la rama (API de GitHub o repo bare); None si la rama no está.
+    # Todo se resuelve con búsquedas en el conjunto, sin tocar el disco.
+    # Devuelve ({módulo instalado: tiene carpeta migrations}, {módulos no encontrados})
+    if tree is None:
+        return {}, set(modulos_csv)
+    modulos_en_repo = tree_modules(tree)
+    instalados = modulos_csv & modulos_en_repo
+    no_encontrados = modulos_csv - modulos_en_repo
+    return {m: f"{m}/migrations" in tree for m in instalados}, no_encontrados
+
+def log_repo_modules(repo, branch, migraciones, no_encontrados):
     log(f"\n📦 Repositorio: {repo} @ {branch}")
     log("=" * 60)
 
-    if instalados:
+    if migraciones:
         log("\n✅ INSTALADOS (definidos en CSV y presentes en repo):")
-        for m in sorted(instalados):
+        for m in sorted(migraciones):
             log(f"    🔍 {m} @ {branch}")
 
     if no_encontrados:
@@ -124,7 +503,30 @@ def log_repo_modules(repo, branch, repo_dir, modules):
         for m in sorted(no_encontrados):
             log(f"    🔍 {m} @ {branch}")
 
-    return instalados, no_encontrados
+def analyze_repo(repo_url, repo, modulos_csv, branches, save=False, dry_run=False, existe=None, api_pool=None):
+    # Tarea completa de un repositorio (se ejecuta en un hilo): clonado y análisis
+    # de todas sus ramas. Devuelve (encontrado, {rama: resultado de find_repo_modules});
+    # encontrado es None si alguna rama se analizó sin poder actualizarla.
+    # existe: lo que dice la caché (None si no se sabe)
+    if existe is False:
+        return False, {}
+    if dry_run and existe:
+        arboles, encontrado = {}, True
+    elif dry_run:
+        arboles, encontrado = probe_repo(repo_url)
+    else:
+        # Para copiar las carpetas migrations hace falta el contenido: siempre se clona
+        arboles, encontrado = sync_repo(repo_url, repo, branches, None if save else api_pool)
+    if encontrado is False:
+        return False, {}
+    bare_dir = os.path.join(CLONES_DIR, repo, ".bare")
+    if dry_run and os.path.isdir(bare_dir):
+        # Sin clonar: se analiza lo que ya haya en el repo bare de ejecuciones anteriores
+        for branch in branches:
+            tree = git_tree(bare_dir, branch)
+            if tree is not None:
+                arboles[branch] = tree
+    return encontrado, {branch: find_repo_modules(modulos_csv, arboles.get(branch)) for branch in branches}
 
 
 def parse_arguments():
@@ -136,142 +538,231 @@ def parse_arguments():
     parser.add_argument("--dry-run", action="store_true", help="Simula sin escribir archivos ni clonar")
     parser.add_argument("--log", help="Archivo log (se guarda en module-collector/)")
     parser.add_argument("--compact", action="store_true", help="Usar formato compacto @version para los informes")
+    parser.add_argument("--refresh-cache", action="store_true", help="Ignora la caché de repositorios existentes")
+    parser.add_argument("--strict-csv", action="store_true", help="Leer el CSV con el módulo csv (campos con comas o saltos de línea)")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Número de repositorios clonados en paralelo (por defecto: 4)")
     return parser.parse_args()
 
 
 
-def parse_csv(file):
-    repos_data = defaultdict(list)
-    csv_errors = []
+def split_csv_rows(csvfile):
+    # El CSV son siempre dos columnas sin comas dentro: basta con partir cada línea.
+    # Se quitan las comillas que añade la exportación de Odoo. Una fila con más
+    # columnas sale con todas ellas y se rechaza en iter_csv
+    for line in csvfile:
+        line = line.rstrip("\r\n")
+        yield [field.strip().strip('"') for field in line.split(",")] if line.strip() else []
+
+def iter_csv(file, csv_errors, strict=False):
+    # Lee el CSV fila a fila y va entregando (repo, módulo, url, línea) válidos;
+    # las filas erróneas se anotan en csv_errors sobre la marcha
     with open(file, newline='') as csvfile:
-        reader = csv.reader(csvfile)
+        reader = csv.reader(csvfile, dialect="unix") if strict else split_csv_rows(csvfile)
         for line_num, row in enumerate(reader, start=1):
-            if len(row) < 2:
+            if len(row) != 2:
                 log(f"❌ Fila {line_num} inválida: {row}")
                 csv_errors.append((line_num, row))
                 continue
-            module, url = row[0].strip(), row[1].strip()
-            repo = extract_repo_name(url)
+            module, url = (field.strip() for field in row)
+            # Descarte rápido de lo que no puede ser una URL antes de aplicar la regex
+            repo = None
+            if "/" in url and not any(c.isspace() for c in url):
+                repo = extract_repo_name(url)
             if not repo:
                 log(f"❌ Fila {line_num}, URL inválida: {url}")
                 csv_errors.append((line_num, row))
                 continue
-            repos_data[repo].append((module, url, line_num))
+            yield repo, module, url, line_num
+
+def parse_csv(file, strict=False):
+    # Los informes necesitan todos los módulos de cada repositorio, que pueden
+    # aparecer en cualquier punto del fichero: se agrupan aquí
+    repos_data = defaultdict(list)
+    csv_errors = []
+    # (repo, módulo) ya leídos: un módulo repetido se analiza una sola vez
+    vistos = set()
+    for repo, module, url, line_num in iter_csv(file, csv_errors, strict):
+        if (repo, module) in vistos:
+            continue
+        vistos.add((repo, module))
+        repos_data[repo].append((module, url, line_num))
     return repos_data, csv_errors
 
-def analyze_repos(args, repos_data, csv_errors):
+def analyze_repos(args, repos_data, csv_errors, save_pool, api_pool):
     start_v = int(args.start.split('.')[0])
     end_v = int(args.end.split('.')[0])
     branches = [f"{v}.0" for v in range(start_v, end_v + 1)]
 
     resumen = {}
-
-    for repo, modules in repos_data.items():
-        resumen[repo] = {
-            "con_migrations": defaultdict(list),
-            "sin_migrations": set(),
-            "errores": [],
-            "no_encontrados": defaultdict(list),
-            "lineas": {}
+    copias = []
+
+    # Repositorios comprobados hace menos de REPO_CACHE_TTL: no se vuelve a preguntar.
+    # Con --refresh-cache se ignoran al consultar, pero el fichero se conserva y
+    # solo se sobrescriben las entradas de los repositorios de esta ejecución
+    repo_cache = load_repo_cache()
+    en_cache = {
+        repo: None if args.refresh_cache else cached_repo_exists(repo_cache, modules[0][1])
+        for repo, modules in repos_data.items()
+    }
+    # Módulos del CSV por repositorio: no cambian de una rama a otra
+    modulos_csv_by_repo = {repo: frozenset(m for m, _, _ in modules) for repo, modules in repos_data.items()}
+
+    # Cada repositorio se procesa en un hilo (sus ramas comparten el repo bare).
+    # Los resultados se recogen en el orden del CSV, así que el log y los
+    # informes no dependen de qué hilo termine antes.
+    pool = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+    try:
+        futures = {
+            repo: pool.submit(
+                analyze_repo, modules[0][1], repo, modulos_csv_by_repo[repo], branches,
+                args.save_migrations, args.dry_run, en_cache[repo], api_pool,
+            )
+            for repo, modules in repos_data.items()
         }
 
-        for branch in branches:
+        for repo, modules in repos_data.items():
+            resumen[repo] = {
+                "con_migrations": defaultdict(set),
+                "sin_migrations": set(),
+                "errores": [],
+                "no_encontrados": defaultdict(list),
+                "lineas": {}
+            }
             repo_url = modules[0][1]
-            repo_dir = os.path.join(CLONES_DIR, repo, branch)
 
-            if not repo_exists(repo_url):
+            try:
+                encontrado, resultados = futures[repo].result()
+            except Exception as e:
+                # Clone, ls-remote o fetch fallidos sin copia local que analizar:
+                # no se sabe qué hay en el repositorio, es un error y no "no encontrado"
+                log(f"⚠️ Error al sincronizar {repo_url}: {e}")
+                for mod, _, _ in modules:
+                    resumen[repo]["errores"].append(f"{mod} (no se pudo analizar el repositorio: {e})")
+                continue
+            else:
+                # Solo se cachea un resultado comprobado contra el servidor
+                if en_cache[repo] is None and encontrado is not None:
+                    repo_cache[repo_url] = {
+                        "exists": encontrado,
+                        "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+                    }
+
+            if encontrado is None:
+                resumen[repo]["errores"].append("no se pudo actualizar el repositorio: se analiza la copia local")
+            elif not encontrado:
                 log(f"❌ Repositorio no encontrado: {repo_url}")
                 for mod, _, line in modules:
-                    resumen[repo]["errores"].append(f"{mod} @ {branch} (repo no encontrado)")
+                    resumen[repo]["errores"].append(f"{mod} @ {branches[0]} (repo no encontrado)")
                     csv_errors.append((line, [mod, repo_url]))
-                break
+                continue
 
-            if not args.dry_run:
-                ensure_repo_cloned(repo_url, repo_dir, branch)
+            # Lo que no depende de la rama se calcula una vez por repositorio
+            datos = resumen[repo]
+            datos["lineas"].update((module, line) for module, _, line in modules)
+            bare_dir = os.path.join(CLONES_DIR, repo, ".bare")
+            a_guardar = {}
 
-            _, no_encontrados = log_repo_modules(repo, branch, repo_dir, modules)
+            for branch in branches:
+                if branch in resultados:
+                    migraciones, no_encontrados = resultados[branch]
+                else:
+                    migraciones, no_encontrados = find_repo_modules(modulos_csv_by_repo[repo])
+                log_repo_modules(repo, branch, migraciones, no_encontrados)
+
+                for module, _, _ in modules:
+                    if module in no_encontrados:
+                        datos["no_encontrados"][module].append(branch)
+                        continue
+
+                    if migraciones[module]:
+                        datos["con_migrations"][module].add(branch)
+                        a_guardar.setdefault(branch, []).append(module)
+                    else:
+                        datos["sin_migrations"].add(module)
+
+            if args.save_migrations and a_guardar:
+                # Las copias van en segundo plano mientras se sigue analizando
+                copias.append(save_pool.submit(save_repo_migrations, repo, a_guardar, bare_dir))
+    except KeyboardInterrupt:
+        # Ctrl+C: los repositorios en cola se cancelan en lugar de esperarlos
+        INTERRUPTED.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
 
-            for module, _, line in modules:
-                resumen[repo]["lineas"][module] = line
+    save_repo_cache(repo_cache)
 
-                if module in no_encontrados:
-                    resumen[repo]["no_encontrados"][module].append(branch)
-                    continue
+    # Las versiones de cada módulo se ordenan aquí una sola vez: los informes las usan tal cual
+    for data in resumen.values():
+        data["con_migrations"] = {mod: sorted(vers) for mod, vers in data["con_migrations"].items()}
+        data["no_encontrados"] = {mod: sorted(vers) for mod, vers in data["no_encontrados"].items()}
+    for copia in copias:
+        copia.result()  # propaga los errores de copia
+    return resumen
 
-                mod_path = os.path.join(repo_dir, module, "migrations")
-                if os.path.isdir(mod_path):
-                    resumen[repo]["con_migrations"][module].append(branch)
-                    if args.save_migrations:
-                        save_migrations(repo, branch, module, repo_dir)
-                else:
-                    resumen[repo]["sin_migrations"].add(module)
+# "@14.0 @15.0": formato común de las listas de versiones en todos los informes
+def format_versions(versions):
+    return " ".join(f"@{v}" for v in versions)
 
-    return resumen
+# Cada informe tiene su propio fichero y solo lee resumen: se escriben en paralelo
+def write_txt(path, content):
+    with open(path, "w", encoding="utf-8", buffering=REPORT_BUFFER) as txt:
+        txt.write(content)
 
-def generate_txt_reports(resumen, compact=False):
-    def write_section_header(txt, titulo):
-        txt.write("\n" + "═" * 60 + "\n")
-        txt.write(f"{titulo.center(60)}\n")
-        txt.write("═" * 60 + "\n\n")
+def write_csv(path, header, rows):
+    with open(path, "w", newline='', encoding="utf-8", buffering=REPORT_BUFFER) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def generate_txt_reports(resumen, pool, compact=False):
+    # Cada bloque se construye como lista de cadenas y se vuelca con un solo write
+    def section_header(titulo):
+        return ["\n" + "═" * 60 + "\n", f"{titulo.center(60)}\n", "═" * 60 + "\n\n"]
 
-    def write_versions_line(mod, versions):
+    def versions_lines(mod, versions):
         if compact:
-            version_str = " ".join(f"@{v}" for v in sorted(versions))
-            return f"    🔹 {mod}: {version_str}\n"
-        else:
-            lines = [f"    🔹 {mod}:\n"]
-            lines += [f"        - {v}\n" for v in sorted(versions)]
-            return "".join(lines)
-
-    def write_block_migrations(txt):
-        write_section_header(txt, "📋  RESUMEN FINAL DE MIGRACIONES  📋")
-        for repo, data in resumen.items():
-            if not data["con_migrations"]:
-                continue
-            txt.write(f"\n📁 Repositorio: {repo}\n")
-            for mod, vers in sorted(data["con_migrations"].items()):
-                txt.write(write_versions_line(mod, vers))
-
-    def write_block_not_found(txt):
-        write_section_header(txt, "💨 MÓDULOS NO ENCONTRADOS EN ALGUNAS VERSIONES")
-        for repo, data in resumen.items():
-            no_enc = data.get("no_encontrados", {})
-            if not no_enc:
-                continue
-            txt.write(f"\n📁 Repositorio: {repo}\n")
+            return [f"    🔹 {mod}: {format_versions(versions)}\n"]
+        return [f"    🔹 {mod}:\n"] + [f"        - {v}\n" for v in versions]
+
+    # Un único recorrido de resumen rellena los tres bloques
+    repos = []
+    migraciones = section_header("📋  RESUMEN FINAL DE MIGRACIONES  📋")
+    no_encontrados = section_header("💨 MÓDULOS NO ENCONTRADOS EN ALGUNAS VERSIONES")
+    for repo, data in resumen.items():
+        con_migrations = data["con_migrations"]
+
+        repos.append(f"\n{'*' * 60}\nREPOSITORIO: {repo}\n{'*' * 60}\n")
+        repos.append("\n✅ CON MIGRATIONS\n")
+        repos += [f"  • {mod}: {format_versions(vers)}\n" for mod, vers in con_migrations.items()]
+        repos.append("\n🚫 SIN MIGRATIONS\n")
+        repos += [f"  • {mod}\n" for mod in data["sin_migrations"] if mod not in con_migrations]
+        repos.append("\n❌ ERRORES\n")
+        repos += [f"  • {err}\n" for err in data["errores"]]
+
+        if con_migrations:
+            migraciones.append(f"\n📁 Repositorio: {repo}\n")
+            for mod in sorted(con_migrations):
+                migraciones += versions_lines(mod, con_migrations[mod])
+
+        no_enc = data.get("no_encontrados", {})
+        if no_enc:
+            no_encontrados.append(f"\n📁 Repositorio: {repo}\n")
             for mod, versions in sorted(no_enc.items()):
-                version_str = " ".join(f"@{v}" for v in sorted(versions))
-                txt.write(f"    🔍 {mod}: No encontrado en {version_str}\n")
-
-    # analysis-full.txt
-    with open(TXT_SUMMARY, "w", encoding="utf-8") as txt:
-        for repo, data in resumen.items():
-            txt.write(f"\n{'*' * 60}\nREPOSITORIO: {repo}\n{'*' * 60}\n")
-            txt.write("\n✅ CON MIGRATIONS\n")
-            for mod, vers in data["con_migrations"].items():
-                version_str = " ".join(f"@{v}" for v in sorted(vers))
-                txt.write(f"  • {mod}: {version_str}\n")
-            txt.write("\n🚫 SIN MIGRATIONS\n")
-            for mod in data["sin_migrations"]:
-                if mod not in data["con_migrations"]:
-                    txt.write(f"  • {mod}\n")
-            txt.write("\n❌ ERRORES\n")
-            for err in data["errores"]:
-                txt.write(f"  • {err}\n")
-
-        txt.write("\n")
-        write_block_migrations(txt)
-        txt.write("\n")
-        write_block_not_found(txt)
-
-    with open(TXT_MIGRATION, "w", encoding="utf-8") as txt:
-        write_block_migrations(txt)
-
-    with open(TXT_NOT_FOUND, "w", encoding="utf-8") as txt:
-        write_block_not_found(txt)
-
-
-def generate_csv_reports(resumen, csv_errors, compact=False):
+                no_encontrados.append(f"    🔍 {mod}: No encontrado en {format_versions(versions)}\n")
+
+    # Los bloques de resumen se unen una vez y se reutilizan en los tres ficheros
+    migraciones = "".join(migraciones)
+    no_encontrados = "".join(no_encontrados)
+
+    return [
+        pool.submit(write_txt, TXT_SUMMARY, "".join(repos) + "\n" + migraciones + "\n" + no_encontrados),
+        pool.submit(write_txt, TXT_MIGRATION, migraciones),
+        pool.submit(write_txt, TXT_NOT_FOUND, no_encontrados),
+    ]
+
+
+def generate_csv_reports(resumen, csv_errors, pool, compact=False):
     rows_migration = []
     rows_not_found = []
     repo_mods = defaultdict(list)
@@ -280,77 +771,72 @@ def generate_csv_reports(resumen, csv_errors, compact=False):
     for repo in repos:
         data = resumen[repo]
 
-        # Módulos con migrations
-        for mod, vers in sorted(data["con_migrations"].items()):
-            for v in sorted(vers):
-                rows_migration.append([repo, mod, v])
-                if compact:
-                    version_str = " ".join(f"@{v}" for v in sorted(vers))
-                    if mod not in [m.split(":")[0] for m in repo_mods[repo]]:
-                        repo_mods[repo].append(f"{mod}: {version_str}")
-                    break  # ya se añadió en modo compacto
-                else:
-                    repo_mods[repo].append(f"{mod}: @{v}")
+        # Módulos con migrations (cada módulo aparece una sola vez en con_migrations)
+        for mod, versiones in sorted(data["con_migrations"].items()):
+            rows_migration.extend((repo, mod, v) for v in versiones)
+            if compact:
+                # Modo compacto: una sola celda por módulo con todas sus versiones
+                repo_mods[repo].append(f"{mod}: {format_versions(versiones)}")
+            else:
+                repo_mods[repo].extend(f"{mod}: @{v}" for v in versiones)
 
         # Módulos no encontrados
-        for mod, versions in data.get("no_encontrados", {}).items():
-            version_str = " ".join(f"@{v}" for v in sorted(versions))
-            rows_not_found.append([repo, mod, version_str])
+        rows_not_found.extend(
+            (repo, mod, format_versions(versions))
+            for mod, versions in data.get("no_encontrados", {}).items()
+        )
 
-    # === CSV: analysis-migration.csv
-    with open(CSV_MIGRATION, "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["Repositorio", "Módulo", "Versión"])
-        writer.writerows(rows_migration)
+    # === CSV: analysis-migration.csv y analysis-not-found.csv
+    escrituras = [
+        pool.submit(write_csv, CSV_MIGRATION, ["Repositorio", "Módulo", "Versión"], rows_migration),
+        pool.submit(write_csv, CSV_NOT_FOUND, ["Repositorio", "Módulo", "Versiones No Encontradas"], rows_not_found),
+    ]
 
-    # === CSV: analysis-not-found.csv
-    with open(CSV_NOT_FOUND, "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["Repositorio", "Módulo", "Versiones No Encontradas"])
-        writer.writerows(rows_not_found)
-
-    # === CSV: analysis-by-report.csv
-    max_rows = max((len(mods) for mods in repo_mods.values()), default=0)
-    rows_by_report = []
-    for i in range(max_rows):
-        row = []
-        for repo in repos:
-            mods = repo_mods.get(repo, [])
-            row.append(mods[i] if i < len(mods) else "")
-        rows_by_report.append(row)
-
-    with open(CSV_BY_REPORT, "w", newline='', encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(repos)
-        writer.writerows(rows_by_report)
+    # === CSV: analysis-by-report.csv (una columna por repositorio)
+    rows_by_report = zip_longest(*(repo_mods.get(repo, []) for repo in repos), fillvalue="")
+    escrituras.append(pool.submit(write_csv, CSV_BY_REPORT, repos, rows_by_report))
 
     # === CSV: analysis-errors.csv
     if csv_errors:
-        with open(CSV_ERRORS, "w", newline='', encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["Línea", "Contenido"])
-            for line, row in csv_errors:
-                writer.writerow([f"{line}", " | ".join(row)])
+        rows_errors = [(f"{line}", " | ".join(row)) for line, row in csv_errors]
+        escrituras.append(pool.submit(write_csv, CSV_ERRORS, ["Línea", "Contenido"], rows_errors))
+    return escrituras
 
 
 def main():
-    global LOG_FILE
+    global LOG_FH
     args = parse_arguments()
     if args.log:
-        LOG_FILE = os.path.join(BASE_DIR, args.log)
-        with open(LOG_FILE, "w", encoding="utf-8") as f:
-            f.write("")
-    repos_data, csv_errors = parse_csv(args.file)
-    resumen = analyze_repos(args, repos_data, csv_errors)
-    generate_txt_reports(resumen, compact=args.compact)
-    generate_csv_reports(resumen, csv_errors)
+        log_file = os.path.join(BASE_DIR, args.log)
+        LOG_FH = open(log_file, "w", buffering=1 << 16, encoding="utf-8")
+        atexit.register(LOG_FH.close)
+    repos_data, csv_errors = parse_csv(args.file, strict=args.strict_csv)
+    save_pool = ThreadPoolExecutor(max_workers=8)
+    # Como mucho 16 peticiones a la API de GitHub en vuelo a la vez
+    api_pool = ThreadPoolExecutor(max_workers=16)
+    try:
+        resumen = analyze_repos(args, repos_data, csv_errors, save_pool, api_pool)
+    except KeyboardInterrupt:
+        # Tampoco se esperan las copias de migrations ni las peticiones pendientes
+        INTERRUPTED.set()
+        for pool in (save_pool, api_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    api_pool.shutdown()
+    save_pool.shutdown()
+    with ThreadPoolExecutor(max_workers=4) as report_pool:
+        escrituras = generate_txt_reports(resumen, report_pool, compact=args.compact)
+        escrituras += generate_csv_reports(resumen, csv_errors, report_pool, compact=args.compact)
+        # result() propaga cualquier error de escritura
+        for escritura in escrituras:
+            escritura.result()
 
     log(" 🏁 Análisis completo. Archivos generados en module-collector/")
 
     if csv_errors:
         log("\n ⚠️ Se encontraron errores en el CSV:\n")
         for line, row in csv_errors:
-            if len(row) < 2:
+            if len(row) != 2:
                 log(f"  • Línea {line}: Formato inválido → {row}")
             else:
                 module, repo_url = row